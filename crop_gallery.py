@@ -0,0 +1,421 @@
+""" Class-wise crop gallery: review every box of one class across the open folder.
+
+Boxes are found by scanning the sidecars in a process pool. Crops are made only
+when the list view asks for a visible cell: a QThreadPool worker decodes just the
+region around the box, de-rotates it and saves it to
+<folder>/.intellitag_cache/crops/. After that a crop is a single small JPEG read.
+"""
+
+
+import os
+import hashlib
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from PyQt5.QtCore import (
+    Qt, QPoint, QRect, QPointF, QSize, QObject, QRunnable, QThreadPool, QAbstractListModel, QModelIndex,
+    pyqtSignal
+)
+from PyQt5.QtGui import QImage, QImageReader, QPainter, QPixmap, QColor
+from PyQt5.QtWidgets import (
+    QApplication, QWidget, QListView, QComboBox, QPushButton, QLabel, QHBoxLayout, QVBoxLayout,
+    QAbstractItemView, QMessageBox
+)
+
+from dataset_utils import load_boxes, save_boxes, sidecar_path, box_corners
+
+
+CROP_SIZE = 128  # longest side of a crop, px
+CACHE_DIR = os.path.join(".intellitag_cache", "crops")
+MEMORY_CACHE = 2000  # decoded crops kept in memory
+
+
+def _boxes_with_label(args):
+    """Worker entry point: ([(img_path, box index, box)] for boxes of `label` in one sidecar, ok)."""
+    img_path, label = args
+    try:
+        boxes = load_boxes(sidecar_path(img_path))
+    except (OSError, ValueError):
+        return [], False
+    found = [(img_path, i, b) for i, b in enumerate(boxes) if b.get("label", "") == label]
+    # crops and tooltips need numeric geometry; a box without it can't be shown at all
+    if not all(_has_geometry(b) for _, _, b in found):
+        return [], False
+    return found, True
+
+
+def _has_geometry(box):
+    return (all(isinstance(box.get(k), (int, float)) for k in ("cx", "cy", "w", "h"))
+            and isinstance(box.get("angle", 0.0), (int, float)))
+
+
+def scan_class(image_paths, label, workers=None):
+    """Every box labelled `label` as (img_path, box index, box) tuples, in folder order.
+
+    Returns (boxes, list of sidecar paths that couldn't be read or hold malformed boxes).
+    """
+    out = []
+    skipped = []
+    with Pool(workers) as pool:
+        for p, (found, ok) in zip(image_paths, pool.imap(_boxes_with_label, [(p, label) for p in image_paths],
+                                                          chunksize=64)):
+            if ok:
+                out.extend(found)
+            else:
+                skipped.append(sidecar_path(p))
+    return out, skipped
+
+
+def same_box(a, b, tol=1e-3):
+    """True if two box dicts have the same label and (up to JSON round-off) the same geometry."""
+    if a.get("label", "") != b.get("label", ""):
+        return False
+    try:
+        return all(abs(float(a.get(k, 0.0)) - float(b.get(k, 0.0))) <= tol for k in ("cx", "cy", "w", "h", "angle"))
+    except (TypeError, ValueError):
+        return False
+
+
+def find_box(boxes, box, hint=None, taken=()):
+    """Index of the entry in `boxes` matching `box`, trying `hint` first. None if it's gone.
+
+    Sidecar order isn't stable (the editor saves boxes in scene order), so a stored
+    index is only a hint.
+    """
+    if hint is not None and 0 <= hint < len(boxes) and hint not in taken and same_box(boxes[hint], box):
+        return hint
+    for i, b in enumerate(boxes):
+        if i not in taken and same_box(b, box):
+            return i
+    return None
+
+
+def crop_key(img_path, box):
+    """Cache key: changes whenever the image file or the box geometry changes (not the label)."""
+    try:
+        mtime = os.stat(img_path).st_mtime_ns
+    except OSError:
+        mtime = 0  # image went away; rendering will fail and be reported on the crop
+    geom = ",".join(f"{box[k]:.2f}" for k in ("cx", "cy", "w", "h")) + f",{box.get('angle', 0.0):.2f}"
+    return hashlib.sha1(f"{img_path}|{mtime}|{geom}|{CROP_SIZE}".encode()).hexdigest()
+
+
+def render_crop(img_path, box, size=CROP_SIZE):
+    """The box's contents, rotated upright and scaled so the longest side is `size`."""
+    xs, ys = zip(*box_corners(box))
+    reader = QImageReader(img_path)
+    clip = QRect(int(min(xs)), int(min(ys)), int(max(xs) - min(xs)) + 2, int(max(ys) - min(ys)) + 2)
+    if reader.size().isValid():
+        clip = clip.intersected(QRect(QPoint(0, 0), reader.size()))
+    if clip.isEmpty():
+        return None
+    # only the region around the box gets decoded (or cropped right after, for formats that can't clip)
+    reader.setClipRect(clip)
+    src = reader.read()
+    if src.isNull():
+        return None
+
+    scale = size / max(box["w"], box["h"], 1e-6)
+    out = QImage(max(1, round(box["w"] * scale)), max(1, round(box["h"] * scale)), QImage.Format_RGB32)
+    out.fill(QColor(0, 0, 0))
+    p = QPainter(out)
+    p.setRenderHint(QPainter.SmoothPixmapTransform)
+    p.translate(out.width() / 2, out.height() / 2)
+    p.scale(scale, scale)
+    p.rotate(-box.get("angle", 0.0))
+    p.translate(-box["cx"], -box["cy"])
+    p.drawImage(QPointF(clip.x(), clip.y()), src)
+    p.end()
+    return out
+
+
+class _CropSignals(QObject):
+    done = pyqtSignal(str, QImage)
+    failed = pyqtSignal(str, str)
+
+
+class CropTask(QRunnable):
+    """Load a crop from the disk cache, or render and cache it."""
+
+    def __init__(self, key, img_path, box, cache_dir):
+        super().__init__()
+        self.key = key
+        self.img_path = img_path
+        self.box = box
+        self.cache_dir = cache_dir
+        self.signals = _CropSignals()
+
+    def run(self):
+        # An exception escaping QRunnable.run aborts the whole app under PyQt5 5.15
+        try:
+            path = os.path.join(self.cache_dir, self.key + ".jpg")
+            img = QImage(path) if os.path.exists(path) else QImage()
+            if img.isNull():
+                img = render_crop(self.img_path, self.box)
+                if img is None:
+                    raise OSError(f"can't read {os.path.basename(self.img_path)}")
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    img.save(path, "JPG", 90)
+                except OSError:
+                    pass  # e.g. read-only dataset folder: show the crop, just don't cache it
+        except Exception as e:
+            self.signals.failed.emit(self.key, str(e))
+            return
+        self.signals.done.emit(self.key, img)
+
+
+class CropModel(QAbstractListModel):
+    """One row per box. Crops are requested lazily from data(), i.e. only for cells the view paints."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.entries = []  # (img_path, box index, box)
+        self.keys = []
+        self._rows = {}  # crop key -> rows showing it
+        self._pixmaps = OrderedDict()  # small LRU of decoded crops
+        self._pending = set()
+        self._failed = {}  # crop key -> error message
+        self._priority = 0
+        self.pool = QThreadPool.globalInstance()
+        self.placeholder = QPixmap(CROP_SIZE, CROP_SIZE)
+        self.placeholder.fill(QColor(60, 60, 60))
+        self.error_placeholder = QPixmap(CROP_SIZE, CROP_SIZE)
+        self.error_placeholder.fill(QColor(120, 30, 30))
+
+    def set_entries(self, entries):
+        self.beginResetModel()
+        self.entries = list(entries)
+        self.keys = [None] * len(self.entries)  # computed lazily, needs a stat()
+        self._rows = {}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def _key(self, row):
+        if self.keys[row] is None:
+            img_path, _, box = self.entries[row]
+            self.keys[row] = crop_key(img_path, box)
+            self._rows.setdefault(self.keys[row], []).append(row)
+        return self.keys[row]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        img_path, box_idx, box = self.entries[index.row()]
+        if role == Qt.DecorationRole:
+            key = self._key(index.row())
+            pix = self._pixmaps.get(key)
+            if pix is not None:
+                self._pixmaps.move_to_end(key)
+                return pix
+            if key in self._failed:
+                return self.error_placeholder
+            if key not in self._pending:
+                self._pending.add(key)
+                task = CropTask(key, img_path, box,
+                                os.path.join(os.path.dirname(img_path), CACHE_DIR))
+                task.signals.done.connect(self._on_crop_done)
+                task.signals.failed.connect(self._on_crop_failed)
+                # most recently requested first, so fast scrolling doesn't wait on cells already gone
+                self._priority += 1
+                self.pool.start(task, self._priority)
+            return self.placeholder
+        if role == Qt.ToolTipRole:
+            tip = f"{os.path.basename(img_path)}  #{box_idx}  {box['w']:.0f}x{box['h']:.0f}"
+            err = self._failed.get(self.keys[index.row()])
+            return f"{tip}\n{err}" if err else tip
+        return None
+
+    def _on_crop_done(self, key, img):
+        self._pending.discard(key)
+        if img.isNull():
+            return
+        self._pixmaps[key] = QPixmap.fromImage(img)
+        while len(self._pixmaps) > MEMORY_CACHE:
+            self._pixmaps.popitem(last=False)
+        self._refresh_key(key)
+
+    def _on_crop_failed(self, key, msg):
+        self._pending.discard(key)
+        self._failed[key] = msg
+        self._refresh_key(key)
+
+    def _refresh_key(self, key):
+        for row in self._rows.get(key, []):
+            if row < len(self.entries):
+                idx = self.index(row)
+                self.dataChanged.emit(idx, idx, [Qt.DecorationRole])
+
+
+class CropGallery(QWidget):
+    """Grid of every crop of one class. Click a crop to jump to it in the editor."""
+    jumpRequested = pyqtSignal(str, dict)
+    labelsChanged = pyqtSignal(list)  # image paths whose sidecars were rewritten
+
+    def __init__(self, image_paths, classes, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Class Review")
+        self.image_paths = list(image_paths)
+
+        self.combo_class = QComboBox()
+        self.combo_class.addItems(classes)
+        self.btn_load = QPushButton("Load")
+        self.lbl_count = QLabel("")
+        self.combo_relabel = QComboBox()
+        self.combo_relabel.addItems(classes)
+        self.btn_relabel = QPushButton("Relabel Selected")
+        self.btn_delete = QPushButton("Delete Selected")
+
+        self.model = CropModel(self)
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setIconSize(QSize(CROP_SIZE, CROP_SIZE))
+        self.view.setGridSize(QSize(CROP_SIZE + 8, CROP_SIZE + 8))
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        # uniform cells + batched layout keep 100k rows cheap to lay out and scroll
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(500)
+        self.view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.view.setModel(self.model)
+
+        top = QHBoxLayout()
+        top.addWidget(QLabel("Class:"))
+        top.addWidget(self.combo_class)
+        top.addWidget(self.btn_load)
+        top.addWidget(self.lbl_count)
+        top.addStretch()
+
+        bottom = QHBoxLayout()
+        bottom.addWidget(self.combo_relabel)
+        bottom.addWidget(self.btn_relabel)
+        bottom.addWidget(self.btn_delete)
+        bottom.addStretch()
+
+        v = QVBoxLayout()
+        v.addLayout(top)
+        v.addWidget(self.view)
+        v.addLayout(bottom)
+        self.setLayout(v)
+
+        self.btn_load.clicked.connect(self.load_class)
+        self.btn_relabel.clicked.connect(self.relabel_selected)
+        self.btn_delete.clicked.connect(self.delete_selected)
+        self.view.clicked.connect(self.on_clicked)
+
+    def load_class(self):
+        label = self.combo_class.currentText()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            entries, skipped = scan_class(self.image_paths, label)
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.model.set_entries(entries)
+        self.lbl_count.setText(f"{len(entries)} boxes")
+        if skipped:
+            names = "\n".join(os.path.basename(p) for p in skipped[:10])
+            QMessageBox.warning(self, "Review Class",
+                                f"Skipped {len(skipped)} images with unreadable label files:\n{names}")
+
+    def on_clicked(self, index):
+        # plain click jumps; Ctrl/Shift clicks are for building a selection
+        if QApplication.keyboardModifiers() != Qt.NoModifier:
+            return
+        img_path, _, box = self.model.entries[index.row()]
+        self.jumpRequested.emit(img_path, box)
+
+    def selected_rows(self):
+        return sorted(i.row() for i in self.view.selectionModel().selectedIndexes())
+
+    def relabel_selected(self):
+        new = self.combo_relabel.currentText()
+        rows = self.selected_rows()
+        if not rows or not new:
+            return
+
+        def relabel(boxes, idxs):
+            for i in idxs:
+                boxes[i]["label"] = new
+
+        self._write_back(rows, relabel, drop=new != self.combo_class.currentText())
+
+    def delete_selected(self):
+        rows = self.selected_rows()
+        if not rows:
+            return
+        if QMessageBox.question(self, "Delete", f"Delete {len(rows)} boxes from their label files?") != QMessageBox.Yes:
+            return
+
+        def delete(boxes, idxs):
+            for i in sorted(idxs, reverse=True):
+                del boxes[i]
+
+        self._write_back(rows, delete, drop=True)
+
+    def _write_back(self, rows, edit, drop):
+        """Apply edit(boxes, box indices) once per affected sidecar, then drop the edited rows if asked.
+
+        Each row's box is looked up in the sidecar as it is now, by geometry and label.
+        Rows whose box changed or went away since the class was loaded are left alone and reported.
+        """
+        by_image = {}
+        for r in rows:
+            by_image.setdefault(self.model.entries[r][0], []).append(r)
+        applied, stale, written = set(), [], {}
+        for img_path, img_rows in by_image.items():
+            ann = sidecar_path(img_path)
+            try:
+                boxes = load_boxes(ann)
+            except (OSError, ValueError):
+                stale.extend([img_path] * len(img_rows))
+                continue
+            found = {}
+            for r in img_rows:
+                _, box_idx, box = self.model.entries[r]
+                i = find_box(boxes, box, box_idx, found.values())
+                if i is None:
+                    stale.append(img_path)
+                else:
+                    found[r] = i
+            if not found:
+                continue
+            edit(boxes, list(found.values()))
+            try:
+                save_boxes(ann, boxes)
+            except OSError:
+                stale.extend([img_path] * len(found))
+                continue
+            applied.update(found)
+            written[img_path] = boxes
+
+        # indices of the rows that stay may have moved; look them up in what was just saved
+        entries = []
+        taken = {p: set() for p in written}
+        for r, (img_path, box_idx, box) in enumerate(self.model.entries):
+            if drop and r in applied:
+                continue
+            if img_path in written:
+                i = find_box(written[img_path], box, box_idx, taken[img_path])
+                if i is not None:
+                    taken[img_path].add(i)
+                    box_idx = i
+            entries.append((img_path, box_idx, box))
+        if drop:
+            scroll = self.view.verticalScrollBar().value()
+            self.model.set_entries(entries)
+            self.view.verticalScrollBar().setValue(scroll)
+            self.lbl_count.setText(f"{len(entries)} boxes")
+        else:
+            self.model.entries = entries
+
+        if written:
+            self.labelsChanged.emit(list(written))
+        if stale:
+            names = sorted({os.path.basename(p) for p in stale})
+            QMessageBox.warning(self, "Label files changed",
+                                f"{len(stale)} boxes were left alone because their label files changed "
+                                f"since the class was loaded. Press Load to refresh.\n\n"
+                                + "\n".join(names[:20]) + ("\n..." if len(names) > 20 else ""))
@@ -0,0 +1,146 @@
+""" Shared helpers for working with labelled image folders (no GUI needed). """
+
+
+import os
+import json
+import math
+import struct
+
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+SIDECAR_EXT = ".json"
+
+
+def is_image_file(fn: str):
+    return os.path.splitext(fn)[1].lower() in IMAGE_EXTS
+
+
+def list_images(folder: str):
+    """Sorted image paths in a folder, same order as the editor's open_folder."""
+    paths = [os.path.join(folder, fn) for fn in os.listdir(folder) if is_image_file(fn)]
+    paths.sort()
+    return paths
+
+
+def sidecar_path(img_path: str):
+    # Labels live next to the image as "<image name>.json"
+    return img_path + SIDECAR_EXT
+
+
+def load_classes(path="classes.txt"):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [ln.strip() for ln in f if ln.strip()]
+
+
+def load_boxes(ann_path: str):
+    """Box dicts from a sidecar, or [] if it doesn't exist.
+
+    Raises ValueError if the file isn't JSON of the form {"boxes": [{...}, ...]}.
+    """
+    if not os.path.exists(ann_path):
+        return []
+    with open(ann_path, "r") as f:
+        try:
+            data = json.load(f)
+        except RecursionError:
+            raise ValueError(f"{os.path.basename(ann_path)}: nested too deeply") from None
+    boxes = data.get("boxes", []) if isinstance(data, dict) else None
+    if not isinstance(boxes, list) or not all(isinstance(b, dict) for b in boxes):
+        raise ValueError(f"{os.path.basename(ann_path)}: expected {{\"boxes\": [box objects]}}")
+    return boxes
+
+
+def save_boxes(ann_path: str, boxes):
+    with open(ann_path, "w") as f:
+        json.dump({"boxes": boxes}, f, indent=2)
+
+
+def box_corners(box: dict):
+    """Scene-space corners of a saved box (same rotation convention as QGraphicsItem.setRotation)."""
+    a = math.radians(box.get("angle", 0.0))
+    c, s = math.cos(a), math.sin(a)
+    hw, hh = box["w"] / 2, box["h"] / 2
+    cx, cy = box["cx"], box["cy"]
+    return [(cx + lx * c - ly * s, cy + lx * s + ly * c)
+            for lx, ly in ((-hw, -hh), (hw, -hh), (hw, hh), (-hw, hh))]
+
+
+# --- Image size from file headers (no decoding) ---
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) are not frames
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        b = f.read(1)
+        while b and b != b"\xff":
+            b = f.read(1)
+        while b == b"\xff":  # skip fill bytes
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue  # standalone markers, no length field
+        if marker in (0xD9, 0xDA):
+            return None  # hit end of image / scan data before any frame header
+        seg = f.read(2)
+        if len(seg) < 2:
+            return None
+        length = struct.unpack(">H", seg)[0]
+        if marker in _JPEG_SOF:
+            hdr = f.read(5)
+            if len(hdr) < 5:
+                return None
+            h, w = struct.unpack(">xHH", hdr)
+            return w, h
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_size(path: str):
+    """(width, height) parsed from the JPEG/PNG/BMP header, or None if unreadable."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(26)
+            if head[:2] == b"\xff\xd8":
+                return _jpeg_size(f)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:2] == b"BM":
+                dib_size = struct.unpack("<I", head[14:18])[0]
+                if dib_size == 12:  # old OS/2 BITMAPCOREHEADER
+                    w, h = struct.unpack("<HH", head[18:22])
+                else:
+                    w, h = struct.unpack("<ii", head[18:26])
+                return w, abs(h)  # negative height means top-down rows
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def read_gray(path: str, size=None):
+    """Decode an image to a 2D uint8 NumPy array, optionally scaled to size=(w, h) while decoding.
+
+    Uses QImageReader so JPEGs are downscaled inside the decoder instead of after a full decode.
+    Returns None if the file can't be read.
+    """
+    import numpy as np
+    from PyQt5.QtCore import QSize
+    from PyQt5.QtGui import QImage, QImageReader
+
+    reader = QImageReader(path)
+    if size is not None:
+        reader.setScaledSize(QSize(int(size[0]), int(size[1])))
+    img = reader.read()
+    if img.isNull():
+        return None
+    img = img.convertToFormat(QImage.Format_Grayscale8)
+    ptr = img.constBits()
+    ptr.setsize(img.byteCount())
+    # rows are padded to bytesPerLine, so crop back to the real width
+    arr = np.frombuffer(ptr, np.uint8).reshape(img.height(), img.bytesPerLine())
+    return arr[:, :img.width()].copy()
@@ -0,0 +1,201 @@
+""" Near-duplicate image detection with perceptual hashes.
+
+Usage: python dedup.py <folder> [--radius 6] [--workers N] [--split 0.2 --seed 0]
+
+Hashes are computed from a 32x32 downscaled decode in worker processes and cached
+per folder by file mtime, so re-runs only hash new or changed images. Lookups go
+through a BK-tree, which only visits the part of the tree within the Hamming radius.
+"""
+
+
+import os
+import json
+import random
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from dataset_utils import list_images, read_gray
+
+
+HASH_SIZE = 8  # 8x8 low-frequency DCT block -> 64 bit hash
+DCT_SIZE = 32
+CACHE_DIR = ".intellitag_cache"
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def phash(gray):
+    """64-bit pHash of a DCT_SIZE x DCT_SIZE grayscale array."""
+    d = _DCT @ gray.astype(np.float64) @ _DCT.T
+    low = d[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_file(path):
+    """Worker entry point: (path, hash) or (path, None) if the image can't be decoded."""
+    gray = read_gray(path, (DCT_SIZE, DCT_SIZE))
+    return path, (None if gray is None else phash(gray))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """BK-tree over 64-bit hashes for Hamming-radius queries."""
+
+    def __init__(self):
+        self.root = None  # node = [hash, [items], {distance: child}]
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = [h, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [item], {}]
+                return
+            node = child
+
+    def query(self, h, radius):
+        """All (distance, item) within `radius` of h."""
+        out = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.extend((d, it) for it in node[1])
+            # triangle inequality: only children at distance d +/- radius can match
+            for cd, child in node[2].items():
+                if d - radius <= cd <= d + radius:
+                    stack.append(child)
+        return out
+
+
+def _cache_path(folder):
+    return os.path.join(folder, CACHE_DIR, "phash.json")
+
+
+def compute_hashes(paths, workers=None, progress=None):
+    """{path: hash} for every decodable image, reusing the per-folder mtime cache."""
+    caches = {}
+    result = {}
+    todo = []
+    for p in paths:
+        folder, fn = os.path.split(p)
+        if folder not in caches:
+            try:
+                with open(_cache_path(folder), "r") as f:
+                    caches[folder] = json.load(f)
+            except (OSError, ValueError):
+                caches[folder] = {}
+        st = os.stat(p)
+        hit = caches[folder].get(fn)
+        if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+            result[p] = int(hit[2], 16)
+        else:
+            todo.append((p, st))
+
+    if todo:
+        stats = {p: st for p, st in todo}
+        with Pool(workers) as pool:
+            for i, (p, h) in enumerate(pool.imap_unordered(hash_file, list(stats), chunksize=16)):
+                if progress:
+                    progress(i + 1, len(todo))
+                if h is None:
+                    continue
+                result[p] = h
+                folder, fn = os.path.split(p)
+                caches[folder][fn] = [stats[p].st_mtime_ns, stats[p].st_size, f"{h:016x}"]
+
+        for folder, cache in caches.items():
+            os.makedirs(os.path.join(folder, CACHE_DIR), exist_ok=True)
+            with open(_cache_path(folder), "w") as f:
+                json.dump(cache, f)
+    return result
+
+
+def find_duplicates(hashes, radius=6):
+    """Group images whose hashes are within `radius` bits. Returns sorted groups of 2+ paths."""
+    tree = BKTree()
+    for p, h in hashes.items():
+        tree.add(h, p)
+
+    parent = {p: p for p in hashes}
+
+    def find(p):
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    for p, h in hashes.items():
+        for _, q in tree.query(h, radius):
+            a, b = find(p), find(q)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    groups = {}
+    for p in hashes:
+        groups.setdefault(find(p), []).append(p)
+    return sorted(sorted(g) for g in groups.values() if len(g) > 1)
+
+
+def split_train_val(paths, groups, val_fraction=0.2, seed=0):
+    """Deterministic train/val split that keeps each duplicate group on one side."""
+    grouped = {p for g in groups for p in g}
+    units = [list(g) for g in groups] + [[p] for p in sorted(paths) if p not in grouped]
+    random.Random(seed).shuffle(units)
+    n_val = round(len(paths) * val_fraction)
+    train, val = [], []
+    for u in units:
+        (val if len(val) < n_val else train).extend(u)
+    return sorted(train), sorted(val)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Find near-duplicate images in a folder.")
+    ap.add_argument("folder")
+    ap.add_argument("--radius", type=int, default=6, help="max Hamming distance between 64-bit hashes")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--split", type=float, default=None, metavar="VAL_FRACTION",
+                    help="also write train.txt / val.txt with duplicate groups kept together")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    paths = list_images(args.folder)
+    hashes = compute_hashes(paths, args.workers)
+    groups = find_duplicates(hashes, args.radius)
+    for g in groups:
+        print("\n".join(g) + "\n")
+    print(f"{len(groups)} duplicate groups, {sum(len(g) for g in groups)} images, out of {len(paths)}")
+
+    if args.split is not None:
+        train, val = split_train_val(paths, groups, args.split, args.seed)
+        for name, part in (("train.txt", train), ("val.txt", val)):
+            with open(os.path.join(args.folder, name), "w") as f:
+                f.writelines(p + "\n" for p in part)
+        print(f"train: {len(train)}  val: {len(val)}")
+
+
+if __name__ == "__main__":
+    main()
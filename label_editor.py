@@ -6,19 +6,27 @@ import json
 import math 
 # from functools import partial 
 
+import numpy as np
+
 from PyQt5.QtCore import (
-    Qt, QPointF, QRectF, QSize, QObject, pyqtSignal
+    Qt, QPointF, QRectF, QSize, QObject, QThread, pyqtSignal
 )
 from PyQt5.QtGui import (
-    QPixmap, QPainter, QPen, QColor, QTransform, QFont, QBrush, QPainterPath
+    QPixmap, QPainter, QPen, QColor, QTransform, QFont, QBrush, QPainterPath, QImage
 )
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton, QFileDialog,
     QGraphicsView, QGraphicsScene, QGraphicsItem, QGraphicsRectItem,
     QGraphicsItemGroup, QVBoxLayout, QHBoxLayout, QComboBox, QSpinBox,
-    QSlider, QMessageBox, QInputDialog 
+    QSlider, QMessageBox, QInputDialog, QCheckBox 
 )
 
+from dataset_utils import list_images, load_boxes, save_boxes, sidecar_path
+import dedup
+import propagate
+import rasterize
+from crop_gallery import CropGallery
+
 
 
 class ResizableRotatedBoxItem(QGraphicsItem):
@@ -455,19 +463,47 @@ class ImageCanvas(QGraphicsView):
         self._current_box = None
         self.drawing_mode = False  # Controlled via 'W' key
         self.image_rect = QRectF()  # Will store image bounds
+        self.mask_overlay = False  # Controlled via 'M' key
+        self._mask_item = None
 
     def load_image(self, img_path: str):
         pix = QPixmap(img_path)
         self.image_width = pix.width()
         self.image_height = pix.height()
+        self._mask_item = None  # deleted by clear()
         self.scene.clear()
         self._pixmap_item = self.scene.addPixmap(pix)
+        self._pixmap_item.setZValue(-2)  # below the mask overlay and the boxes
         
         # 🐛 FIX: Convert QRect to QRectF
         # pix.rect() returns a QRect, but setSceneRect expects a QRectF
         self.setSceneRect(QRectF(pix.rect())) 
         
         self.image_rect = QRectF(0, 0, pix.width(), pix.height())  # Image bounds
+
+    def refresh_mask_overlay(self):
+        """Show the class map rasterize.py would export for the boxes currently on the canvas."""
+        if self._mask_item is not None:
+            self.scene.removeItem(self._mask_item)
+            self._mask_item = None
+        if not self.mask_overlay or self._pixmap_item is None:
+            return
+
+        boxes = [it.to_dict() for it in self.scene.items() if isinstance(it, ResizableRotatedBoxItem)]
+        # labels not in classes.txt still get a colour so they show up in the preview
+        labels = list(self.classes) + sorted({b["label"] for b in boxes} - set(self.classes))
+        index = {c: i + 1 for i, c in enumerate(labels)}
+        cmap = rasterize.class_map(boxes, [index[b["label"]] for b in boxes],
+                                   self.image_height, self.image_width, np.uint16)
+
+        palette = np.zeros((len(labels) + 1, 4), dtype=np.uint8)  # id 0 stays transparent
+        for i in range(1, len(labels) + 1):
+            c = QColor.fromHsvF((i * 0.618034) % 1.0, 0.8, 1.0)
+            palette[i] = (c.red(), c.green(), c.blue(), 110)
+        rgba = np.ascontiguousarray(palette[cmap])
+        img = QImage(rgba.data, self.image_width, self.image_height, rgba.strides[0], QImage.Format_RGBA8888)
+        self._mask_item = self.scene.addPixmap(QPixmap.fromImage(img))  # fromImage copies the buffer
+        self._mask_item.setZValue(-1)
     
     def wheelEvent(self, event):
         # Check if the Ctrl key is pressed
@@ -558,6 +594,8 @@ class ImageCanvas(QGraphicsView):
             self._current_box = None
         else:
             super().mouseReleaseEvent(event)
+        if self.mask_overlay:
+            self.refresh_mask_overlay()
     
     def keyPressEvent(self, event):
         # Forward Left/Right arrow keys to the parent window (AnnotatorWindow)
@@ -571,11 +609,7 @@ class ImageCanvas(QGraphicsView):
         super().keyPressEvent(event)
     
     def load_annotations(self, ann_path: str):
-        if not os.path.exists(ann_path):
-            return
-        with open(ann_path, "r") as f:
-            data = json.load(f)
-        for bd in data.get("boxes", []):
+        for bd in load_boxes(ann_path):
             box = ResizableRotatedBoxItem.from_dict(bd, classes=self.classes)
             self.scene.addItem(box)
 
@@ -584,8 +618,52 @@ class ImageCanvas(QGraphicsView):
         for item in self.scene.items():
             if isinstance(item, ResizableRotatedBoxItem):
                 boxes.append(item.to_dict())
-        with open(ann_path, "w") as f:
-            json.dump({"boxes": boxes}, f, indent=2)
+        save_boxes(ann_path, boxes)
+
+class DuplicateScanThread(QThread):
+    """Hashes the open folder off the UI thread (hashing itself runs in a process pool)."""
+    done = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, folder, paths, radius=6, parent=None):
+        super().__init__(parent)
+        self.folder = folder  # results only apply while this folder is still open
+        self.paths = list(paths)
+        self.radius = radius
+
+    def run(self):
+        # An exception escaping QThread.run aborts the whole app under PyQt5 5.15
+        try:
+            hashes = dedup.compute_hashes(self.paths)
+            groups = dedup.find_duplicates(hashes, self.radius)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.done.emit(groups)
+
+class PropagateThread(QThread):
+    """Batch label propagation through the following frames."""
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(int, list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, paths, start, count, boxes, parent=None):
+        super().__init__(parent)
+        self.paths = list(paths)
+        self.start_idx = start
+        self.count = count
+        self.boxes = boxes
+
+    def run(self):
+        # An exception escaping QThread.run aborts the whole app under PyQt5 5.15
+        try:
+            written, skipped = propagate.propagate_sequence(
+                self.paths, self.start_idx, self.count, self.boxes,
+                progress=self.progress.emit, should_stop=self.isInterruptionRequested)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.done.emit(written, skipped)
 
 class AnnotatorWindow(QWidget):
     def __init__(self):
@@ -601,6 +679,10 @@ class AnnotatorWindow(QWidget):
         self.slider_zoom = QSlider(Qt.Horizontal)
         self.slider_zoom.setRange(10, 400)
         self.slider_zoom.setValue(60)
+        self.btn_dups = QPushButton("Find Duplicates")
+        self.chk_skip_dups = QCheckBox("Skip duplicates")
+        self.btn_propagate = QPushButton("Propagate N...")
+        self.btn_review = QPushButton("Review Class...")
 
         h1 = QHBoxLayout()
         h1.addWidget(self.btn_open)
@@ -612,8 +694,16 @@ class AnnotatorWindow(QWidget):
         h1.addWidget(QLabel("Zoom:"))
         h1.addWidget(self.slider_zoom)
 
+        h2 = QHBoxLayout()
+        h2.addWidget(self.btn_dups)
+        h2.addWidget(self.chk_skip_dups)
+        h2.addWidget(self.btn_propagate)
+        h2.addWidget(self.btn_review)
+        h2.addStretch()
+
         v = QVBoxLayout()
         v.addLayout(h1)
+        v.addLayout(h2)
         v.addWidget(self.canvas)
         self.setLayout(v)
 
@@ -624,13 +714,22 @@ class AnnotatorWindow(QWidget):
         self.btn_add_class.clicked.connect(self.on_add_class)
         self.slider_zoom.valueChanged.connect(self.on_zoom_changed)
         self.combo_labels.currentIndexChanged.connect(self.on_label_changed)
+        self.btn_dups.clicked.connect(self.on_find_duplicates)
+        self.btn_propagate.clicked.connect(self.on_propagate_batch)
+        self.btn_review.clicked.connect(self.on_review_class)
 
         self.canvas.boxCreated.connect(self.on_box_created)
 
+        self.image_folder = None
         self.image_paths = []
         self.current_idx = -1
         self.classes = []
         self.undo_stack = []  # store (action, object) tuples
+        self._saved_boxes = []  # canvas_snapshot() as of the last load / save
+        self.dup_groups = {}  # image path -> sorted list of its near-duplicates (incl. itself)
+        self._dup_thread = None
+        self._propagate_thread = None
+        self.gallery = None
 
         self.load_classes() 
         self.update_title() 
@@ -644,8 +743,18 @@ class AnnotatorWindow(QWidget):
         if self.current_idx >= 0 and self.current_idx < len(self.image_paths):
             image_name = os.path.basename(self.image_paths[self.current_idx])
 
+        dup_status = ""
+        group = self.dup_groups.get(self.current_path())
+        if group:
+            dup_status = f" | Duplicate {group.index(self.current_path()) + 1}/{len(group)} (D: jump)"
+
         # Set the full title
-        self.setWindowTitle(f"Image Labeler | {image_name} | Draw Mode: {mode_status}")
+        self.setWindowTitle(f"Image Labeler | {image_name} | Draw Mode: {mode_status}{dup_status}")
+
+    def current_path(self):
+        if 0 <= self.current_idx < len(self.image_paths):
+            return self.image_paths[self.current_idx]
+        return None
     
     def load_classes(self):
         if os.path.exists("classes.txt"):
@@ -661,11 +770,9 @@ class AnnotatorWindow(QWidget):
         d = QFileDialog.getExistingDirectory(self, "Select Image Folder")
         if not d:
             return
-        exts = {".jpg", ".jpeg", ".png", ".bmp"}
-        self.image_paths = [os.path.join(d, fn)
-                             for fn in os.listdir(d)
-                             if os.path.splitext(fn)[1].lower() in exts]
-        self.image_paths.sort()
+        self.image_folder = d
+        self.image_paths = list_images(d)
+        self.dup_groups = {}
         if self.image_paths:
             self.current_idx = 0
             self.load_current()
@@ -675,8 +782,10 @@ class AnnotatorWindow(QWidget):
         self.canvas.load_image(img)
         ann = img + ".json"
         self.canvas.load_annotations(ann)
+        self.canvas.refresh_mask_overlay()
         # clear undo stack
         self.undo_stack.clear()
+        self._saved_boxes = self.canvas_snapshot()
         self.update_title()
 
     def save_current(self):
@@ -685,19 +794,184 @@ class AnnotatorWindow(QWidget):
         img = self.image_paths[self.current_idx]
         ann = img + ".json"
         self.canvas.save_annotations(ann)
+        self._saved_boxes = self.canvas_snapshot()
+
+    def canvas_snapshot(self):
+        # Order-independent: the scene doesn't keep boxes in the order they were loaded
+        boxes = [it.to_dict() for it in self.canvas.scene.items() if isinstance(it, ResizableRotatedBoxItem)]
+        return sorted(json.dumps(b, sort_keys=True) for b in boxes)
+
+    def is_skipped_duplicate(self, idx):
+        # The first image of a group (in folder order) is kept, the rest are skipped
+        path = self.image_paths[idx]
+        group = self.dup_groups.get(path)
+        return self.chk_skip_dups.isChecked() and group is not None and group[0] != path
 
     def prev_image(self):
-        if self.current_idx > 0:
+        idx = self.current_idx - 1
+        while idx >= 0 and self.is_skipped_duplicate(idx):
+            idx -= 1
+        if idx >= 0:
             # self.save_current()
-            self.current_idx -= 1
+            self.current_idx = idx
             self.load_current()
 
     def next_image(self):
-        if self.current_idx < len(self.image_paths) - 1:
+        idx = self.current_idx + 1
+        while idx < len(self.image_paths) and self.is_skipped_duplicate(idx):
+            idx += 1
+        if idx < len(self.image_paths):
             # self.save_current()
-            self.current_idx += 1
+            self.current_idx = idx
             self.load_current()
 
+    def jump_to_duplicate(self):
+        path = self.current_path()
+        group = self.dup_groups.get(path)
+        if not group:
+            return
+        nxt = group[(group.index(path) + 1) % len(group)]
+        self.current_idx = self.image_paths.index(nxt)
+        self.load_current()
+
+    def on_find_duplicates(self):
+        if not self.image_paths or self._dup_thread is not None:
+            return
+        self.btn_dups.setEnabled(False)
+        self.btn_dups.setText("Hashing...")
+        self._dup_thread = DuplicateScanThread(self.image_folder, self.image_paths, parent=self)
+        self._dup_thread.done.connect(self.on_duplicates_found)
+        self._dup_thread.failed.connect(self.on_duplicates_failed)
+        self._dup_thread.start()
+
+    def finish_duplicate_scan(self):
+        """Clean up the scan thread; True if its results are still for the open folder."""
+        self._dup_thread.wait()
+        current = self._dup_thread.folder == self.image_folder
+        self._dup_thread = None
+        self.btn_dups.setEnabled(True)
+        self.btn_dups.setText("Find Duplicates")
+        return current
+
+    def on_duplicates_failed(self, msg):
+        if self.finish_duplicate_scan():
+            QMessageBox.warning(self, "Duplicates", f"Duplicate scan failed:\n{msg}")
+
+    def on_duplicates_found(self, groups):
+        if not self.finish_duplicate_scan():
+            return  # another folder was opened while hashing
+        self.dup_groups = {p: g for g in groups for p in g}
+        self.update_title()
+        QMessageBox.information(self, "Duplicates",
+                                f"{len(groups)} near-duplicate groups covering {len(self.dup_groups)} images.")
+
+    def propagate_from_previous(self):
+        """Add motion-compensated copies of the previous image's saved boxes, selected for review."""
+        if self.current_idx <= 0:
+            return
+        prev_path = self.image_paths[self.current_idx - 1]
+        boxes = load_boxes(sidecar_path(prev_path))
+        if not boxes:
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            moved = propagate.propagate_boxes(prev_path, self.current_path(), boxes)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        self.canvas.scene.clearSelection()
+        for bd in moved:
+            box = ResizableRotatedBoxItem.from_dict(bd, classes=self.classes)
+            self.canvas.scene.addItem(box)
+            box.setSelected(True)
+            self.undo_stack.append(("create", box))
+
+    def on_propagate_batch(self):
+        if self.current_idx < 0 or self._propagate_thread is not None:
+            return
+        remaining = len(self.image_paths) - 1 - self.current_idx
+        # Start from what's on the canvas, saved or not
+        boxes = [it.to_dict() for it in self.canvas.scene.items() if isinstance(it, ResizableRotatedBoxItem)]
+        if remaining <= 0 or not boxes:
+            return
+        n, ok = QInputDialog.getInt(self, "Propagate",
+                                    "Propagate current boxes through the next N images\n"
+                                    "(images that already have labels are kept):",
+                                    min(10, remaining), 1, remaining)
+        if not ok:
+            return
+        self.btn_propagate.setEnabled(False)
+        self._propagate_thread = PropagateThread(self.image_paths, self.current_idx, n, boxes, parent=self)
+        self._propagate_thread.progress.connect(
+            lambda i, total: self.btn_propagate.setText(f"Propagating {i}/{total}"))
+        self._propagate_thread.done.connect(self.on_propagate_done)
+        self._propagate_thread.failed.connect(self.on_propagate_failed)
+        self._propagate_thread.start()
+
+    def finish_propagate(self):
+        self._propagate_thread.wait()
+        self._propagate_thread = None
+        self.btn_propagate.setEnabled(True)
+        self.btn_propagate.setText("Propagate N...")
+
+    def on_propagate_failed(self, msg):
+        self.finish_propagate()
+        QMessageBox.warning(self, "Propagate", f"Propagation stopped:\n{msg}")
+
+    def on_propagate_done(self, written, skipped):
+        self.finish_propagate()
+        msg = f"Wrote labels for {written} images."
+        if skipped:
+            names = "\n".join(os.path.basename(p) for p in skipped[:10])
+            msg += f"\n\nSkipped {len(skipped)} images with unreadable label files:\n{names}"
+        QMessageBox.information(self, "Propagate", msg)
+
+    def on_review_class(self):
+        if not self.image_paths:
+            return
+        if self.gallery is not None:
+            # close() only hides it; it's parented to us, so its model and crop cache would live on
+            self.gallery.close()
+            self.gallery.deleteLater()
+        self.gallery = CropGallery(self.image_paths, self.classes, parent=self)
+        self.gallery.jumpRequested.connect(self.jump_to_box)
+        self.gallery.labelsChanged.connect(self.on_labels_changed)
+        self.gallery.resize(900, 700)
+        self.gallery.show()
+
+    def jump_to_box(self, img_path, box):
+        """Open img_path and select the box closest to the given (saved) box."""
+        if img_path not in self.image_paths:
+            return
+        idx = self.image_paths.index(img_path)
+        if idx != self.current_idx:
+            self.current_idx = idx
+            self.load_current()
+        items = [it for it in self.canvas.scene.items() if isinstance(it, ResizableRotatedBoxItem)]
+        if not items:
+            return
+        target = QPointF(box["cx"], box["cy"])
+        best = min(items, key=lambda it: (it.pos() - target).manhattanLength())
+        self.canvas.scene.clearSelection()
+        best.setSelected(True)
+        self.canvas.centerOn(best)
+        self.raise_()
+        self.activateWindow()
+
+    def on_labels_changed(self, paths):
+        # The gallery rewrote these sidecars; reload if one of them is on screen
+        if self.current_path() not in paths:
+            return
+        if self.canvas_snapshot() != self._saved_boxes:
+            reply = QMessageBox.question(
+                self, "Labels changed",
+                "The gallery changed the label file of the image on screen, which has unsaved edits.\n\n"
+                "Reload it and discard your edits? Choose No to keep them; saving will then overwrite "
+                "the gallery's change.")
+            if reply != QMessageBox.Yes:
+                return
+        self.load_current()
+
     def on_zoom_changed(self, v):
         scale = v / 100.0
         self.canvas.resetTransform()
@@ -708,6 +982,7 @@ class AnnotatorWindow(QWidget):
         for it in self.canvas.scene.selectedItems():
             if isinstance(it, ResizableRotatedBoxItem):
                 it.setLabel(label)
+        self.canvas.refresh_mask_overlay()
 
     def on_add_class(self):
         text, ok = QInputDialog.getText(self, "Add Class", "Class name:")
@@ -759,6 +1034,13 @@ class AnnotatorWindow(QWidget):
         elif event.modifiers() & Qt.ControlModifier and event.key() == Qt.Key_S:
             # Save only when Ctrl+S is pressed
             self.save_current() 
+        elif event.key() == Qt.Key_D:
+            self.jump_to_duplicate()
+        elif event.key() == Qt.Key_P:
+            self.propagate_from_previous()
+        elif event.key() == Qt.Key_M:
+            # Toggle mask preview
+            self.canvas.mask_overlay = not self.canvas.mask_overlay
         elif event.key() == Qt.Key_W:
             # Toggle draw mode 
             self.canvas.drawing_mode = not self.canvas.drawing_mode 
@@ -766,6 +1048,9 @@ class AnnotatorWindow(QWidget):
             # self.setWindowTitle(f"Image Labeler (Draw Mode: {'ON' if self.canvas.drawing_mode else 'OFF'}): {}")
         else:
             super().keyPressEvent(event)
+            return
+        # boxes may have been added/removed above
+        self.canvas.refresh_mask_overlay()
 
   
 def main():
@@ -0,0 +1,275 @@
+""" Pack a labelled folder into size-bounded tar shards for fast training-data loading.
+
+Usage:
+    python pack_shards.py pack <folder> <out_dir> [--shard-mb 256] [--seed 0] [--workers N] [--repack]
+    python pack_shards.py bench <out_dir> [--folder <folder>] [--limit N]
+
+Each labelled image becomes two tar members, "<image name>" and "<image name>.json",
+so a shard unpacks back into the editor's folder layout. index.json records the
+shard and byte offset of every member, which gives random access without scanning
+the tars.
+
+Packing is incremental. Samples whose image and sidecar are unchanged since the last
+pack (same mtime and size) stay where they are. New or changed samples go into new
+shards, and shards with no live samples left are deleted. Use --repack to rewrite
+everything, e.g. once many old copies have built up in older shards. The order that
+samples are placed into shards is a seeded shuffle, so the same inputs always give
+the same shards.
+"""
+
+
+import os
+import io
+import json
+import time
+import random
+import tarfile
+import argparse
+from multiprocessing import Pool
+
+from dataset_utils import list_images, sidecar_path
+
+
+INDEX_NAME = "index.json"
+TAR_BLOCK = 512
+
+
+def _signature(img_path):
+    """What must match for a packed sample to count as unchanged."""
+    st = os.stat(img_path)
+    ast = os.stat(sidecar_path(img_path))
+    return [st.st_mtime_ns, st.st_size, ast.st_mtime_ns, ast.st_size]
+
+
+def _shard_name(i):
+    return f"shard-{i:06d}.tar"
+
+
+def load_index(out_dir):
+    path = os.path.join(out_dir, INDEX_NAME)
+    if not os.path.exists(path):
+        return {"version": 1, "shards": [], "samples": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_index(out_dir, index):
+    path = os.path.join(out_dir, INDEX_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)  # readers never see a half-written index
+
+
+def write_shard(out_dir, name, items):
+    """Worker entry point: write one shard. items = [(key, img_path, signature)]. Returns {key: entry}."""
+    entries = {}
+    tmp = os.path.join(out_dir, name + ".tmp")
+    with tarfile.open(tmp, "w", format=tarfile.GNU_FORMAT) as tar:
+        for key, img_path, sig in items:
+            entry = {"shard": name, "sig": sig}
+            for field, path, member in (("image", img_path, key),
+                                        ("ann", sidecar_path(img_path), key + ".json")):
+                with open(path, "rb") as f:
+                    data = f.read()
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mtime = sig[0] // 1_000_000_000 if field == "image" else sig[2] // 1_000_000_000
+                tar.addfile(info, io.BytesIO(data))
+                # addfile works on a copy of info, so back the data offset out of the archive position
+                entry[field] = [tar.offset - -(-info.size // TAR_BLOCK) * TAR_BLOCK, info.size]
+            entries[key] = entry
+    os.replace(tmp, os.path.join(out_dir, name))
+    return entries
+
+
+def plan_shards(todo, shard_bytes, first_shard):
+    """Split [(key, img_path, sig)] into consecutive shards of at most ~shard_bytes each."""
+    plans = []
+    cur, cur_bytes = [], 0
+    for item in todo:
+        sig = item[2]
+        # two headers + data padded to whole tar blocks
+        size = 2 * TAR_BLOCK + sum(-(-n // TAR_BLOCK) * TAR_BLOCK for n in (sig[1], sig[3]))
+        if cur and cur_bytes + size > shard_bytes:
+            plans.append(cur)
+            cur, cur_bytes = [], 0
+        cur.append(item)
+        cur_bytes += size
+    if cur:
+        plans.append(cur)
+    return [(_shard_name(first_shard + i), p) for i, p in enumerate(plans)]
+
+
+def pack(folder, out_dir, shard_bytes=256 << 20, seed=0, workers=None, repack=False, log=print):
+    os.makedirs(out_dir, exist_ok=True)
+    old = load_index(out_dir)
+    if repack or old.get("seed", seed) != seed:
+        old = {"version": 1, "shards": old["shards"], "samples": {}}
+    samples = {}
+    todo = []
+    unlabelled = 0
+    for img in list_images(folder):
+        if not os.path.exists(sidecar_path(img)):
+            unlabelled += 1
+            continue
+        key = os.path.basename(img)
+        sig = _signature(img)
+        prev = old["samples"].get(key)
+        if prev is not None and prev["sig"] == sig:
+            samples[key] = prev
+        else:
+            todo.append((key, img, sig))
+
+    todo.sort()
+    random.Random(seed).shuffle(todo)
+    first = 1 + max((int(s[6:12]) for s in old["shards"]), default=-1)
+    plans = plan_shards(todo, shard_bytes, first)
+
+    if plans:
+        with Pool(workers) as pool:
+            results = pool.starmap(write_shard, [(out_dir, name, items) for name, items in plans])
+        for entries in results:
+            samples.update(entries)
+
+    shards = sorted({e["shard"] for e in samples.values()})
+    _save_index(out_dir, {"version": 1, "seed": seed, "shards": shards,
+                          "samples": dict(sorted(samples.items()))})
+    # Only now that the new index is in place are the dead shards unreferenced. Sweep the
+    # whole folder so shards left behind by an interrupted earlier run go too.
+    live = set(shards)
+    for name in os.listdir(out_dir):
+        if name.startswith("shard-") and name.endswith(".tar") and name not in live:
+            os.remove(os.path.join(out_dir, name))
+
+    total = sum(os.path.getsize(os.path.join(out_dir, s)) for s in shards)
+    live_bytes = sum(e["image"][1] + e["ann"][1] for e in samples.values())
+    log(f"{len(samples)} samples in {len(shards)} shards ({total / 1e6:.1f} MB), "
+        f"{len(todo)} (re)packed, {unlabelled} unlabelled images skipped")
+    if total and live_bytes / total < 0.5:
+        log("more than half of the shard bytes are stale copies, consider --repack")
+    return samples
+
+
+class ShardReader:
+    """Random and streaming access to a packed folder."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.index = load_index(out_dir)
+        self.samples = self.index["samples"]
+        self.keys = list(self.samples)
+        self._files = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _read(self, shard, offset, size):
+        f = self._files.get(shard)
+        if f is None:
+            f = self._files[shard] = open(os.path.join(self.out_dir, shard), "rb")
+        f.seek(offset)
+        return f.read(size)
+
+    def read_raw(self, key):
+        """(image bytes, sidecar bytes) without decoding anything."""
+        e = self.samples[key]
+        return self._read(e["shard"], *e["image"]), self._read(e["shard"], *e["ann"])
+
+    def read(self, key):
+        """(image bytes, list of box dicts)."""
+        img, ann = self.read_raw(key)
+        return img, json.loads(ann).get("boxes", [])
+
+    def iter_keys(self, seed=None, epoch=0):
+        """Keys grouped by shard, in offset order. With a seed, shard order and order
+        within each shard are shuffled deterministically per (seed, epoch), but each
+        shard is still read before moving on to the next."""
+        by_shard = {}
+        for k in self.keys:
+            by_shard.setdefault(self.samples[k]["shard"], []).append(k)
+        shards = sorted(by_shard)
+        rng = random.Random(f"{seed}:{epoch}") if seed is not None else None
+        if rng:
+            rng.shuffle(shards)
+        for s in shards:
+            keys = sorted(by_shard[s], key=lambda k: self.samples[k]["image"][0])
+            if rng:
+                rng.shuffle(keys)
+            yield from keys
+
+    def __iter__(self):
+        for k in self.iter_keys():
+            yield (k,) + self.read(k)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _timed(label, keys, read):
+    t = time.perf_counter()
+    n_bytes = 0
+    for k in keys:
+        img, ann = read(k)
+        n_bytes += len(img) + len(ann)
+    dt = max(time.perf_counter() - t, 1e-9)
+    print(f"{label:<28} {len(keys) / dt:10.0f} samples/s {n_bytes / dt / 1e6:9.1f} MB/s")
+
+
+def bench(out_dir, folder=None, limit=None, seed=0):
+    """Print read throughput for the shards (and optionally the loose files they came from).
+
+    Note: the OS page cache makes repeated runs look faster; drop caches between runs for cold numbers.
+    """
+    with ShardReader(out_dir) as reader:
+        seq = list(reader.iter_keys())[:limit]
+        shuffled = list(reader.iter_keys(seed=seed))[:limit]
+        rnd = list(reader.keys)
+        random.Random(seed).shuffle(rnd)
+        rnd = rnd[:limit]
+        _timed("shards, sequential", seq, reader.read_raw)
+        _timed("shards, shuffled by shard", shuffled, reader.read_raw)
+        _timed("shards, fully random", rnd, reader.read_raw)
+
+    if folder:
+        def read_loose(key):
+            path = os.path.join(folder, key)
+            with open(path, "rb") as f, open(sidecar_path(path), "rb") as g:
+                return f.read(), g.read()
+        _timed("loose files, random", rnd, read_loose)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack a labelled folder into tar shards, or benchmark reading them.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("pack")
+    p.add_argument("folder")
+    p.add_argument("out_dir")
+    p.add_argument("--shard-mb", type=float, default=256)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--repack", action="store_true", help="ignore the previous pack and rewrite every shard")
+
+    b = sub.add_parser("bench")
+    b.add_argument("out_dir")
+    b.add_argument("--folder", help="also time reading the original loose files")
+    b.add_argument("--limit", type=int, default=None)
+    b.add_argument("--seed", type=int, default=0)
+
+    args = ap.parse_args()
+    if args.cmd == "pack":
+        pack(args.folder, args.out_dir, int(args.shard_mb * (1 << 20)), args.seed, args.workers, args.repack)
+    else:
+        bench(args.out_dir, args.folder, args.limit, args.seed)
+
+
+if __name__ == "__main__":
+    main()
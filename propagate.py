@@ -0,0 +1,167 @@
+""" Carry boxes from one frame to the next in burst / video-frame folders.
+
+Motion is estimated with FFT phase correlation on downscaled grayscale frames:
+once for the whole frame (global shift), then for a small patch around every box
+to pick up the box's own residual motion. All box patches are sampled and
+correlated as a single (N, P, P) batch, so a few hundred boxes take milliseconds.
+"""
+
+
+import os
+import math
+
+import numpy as np
+
+from dataset_utils import read_gray, read_image_size, load_boxes, save_boxes, sidecar_path
+
+
+MAX_SIDE = 512  # frames are decoded at most this big for motion estimation
+PATCH = 64  # per-box patches are resampled to PATCH x PATCH
+MIN_PEAK = 0.1  # weaker correlation peaks fall back to the global shift
+
+
+def phase_correlate(a, b):
+    """Shift (dy, dx) that moves `a` onto `b`, for a batch of equally sized arrays.
+
+    a, b: (..., H, W). Returns dy, dx, peak, each shaped like the batch dims.
+    Peak height is roughly 1 for a clean match and near 0 for unrelated content.
+    """
+    h, w = a.shape[-2:]
+    win = np.outer(np.hanning(h), np.hanning(w))
+    a = (a - a.mean(axis=(-2, -1), keepdims=True)) * win
+    b = (b - b.mean(axis=(-2, -1), keepdims=True)) * win
+    r = np.conj(np.fft.rfft2(a)) * np.fft.rfft2(b)
+    r /= np.abs(r) + 1e-9
+    corr = np.fft.irfft2(r, s=(h, w))
+
+    batch = corr.shape[:-2]
+    flat = corr.reshape(-1, h, w)
+    k = flat.reshape(len(flat), -1).argmax(axis=1)
+    py, px = np.divmod(k, w)
+    idx = np.arange(len(flat))
+    peak = flat[idx, py, px]
+
+    # parabolic sub-pixel refinement along each axis (neighbours wrap around)
+    def refine(m, z, p):
+        denom = m - 2 * z + p
+        return np.where(np.abs(denom) > 1e-12, 0.5 * (m - p) / np.where(denom == 0, 1, denom), 0.0)
+
+    dy = py + refine(flat[idx, (py - 1) % h, px], peak, flat[idx, (py + 1) % h, px])
+    dx = px + refine(flat[idx, py, (px - 1) % w], peak, flat[idx, py, (px + 1) % w])
+    dy = np.where(dy > h / 2, dy - h, dy)
+    dx = np.where(dx > w / 2, dx - w, dx)
+    return dy.reshape(batch), dx.reshape(batch), peak.reshape(batch)
+
+
+def _sample_patches(img, cx, cy, side, size=PATCH):
+    """Nearest-neighbour resample of square windows (centre cx, cy, width side) into (N, size, size)."""
+    t = (np.arange(size) + 0.5) / size - 0.5
+    xs = np.rint(cx[:, None] + t[None, :] * side[:, None]).astype(np.intp)
+    ys = np.rint(cy[:, None] + t[None, :] * side[:, None]).astype(np.intp)
+    np.clip(xs, 0, img.shape[1] - 1, out=xs)
+    np.clip(ys, 0, img.shape[0] - 1, out=ys)
+    return img[ys[:, :, None], xs[:, None, :]].astype(np.float32)
+
+
+def load_frame(path, max_side=MAX_SIDE):
+    """(downscaled gray array, scale) where scale maps full-res pixels to the array's pixels."""
+    size = read_image_size(path)
+    if size is None:
+        return None, 1.0
+    scale = min(1.0, max_side / max(size))
+    gray = read_gray(path, (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))))
+    return gray, scale
+
+
+def estimate_motion(prev, cur, boxes, scale=1.0):
+    """Per-box (dx, dy) in full-res pixels between two downscaled frames.
+
+    Returns ((global_dx, global_dy), array of shape (N, 2)).
+    """
+    h = min(prev.shape[0], cur.shape[0])
+    w = min(prev.shape[1], cur.shape[1])
+    gdy, gdx, _ = phase_correlate(prev[:h, :w].astype(np.float32), cur[:h, :w].astype(np.float32))
+    gdx, gdy = float(gdx), float(gdy)
+    if not boxes:
+        return (gdx / scale, gdy / scale), np.zeros((0, 2))
+
+    cx = np.array([b["cx"] for b in boxes], dtype=np.float64) * scale
+    cy = np.array([b["cy"] for b in boxes], dtype=np.float64) * scale
+    bw = np.array([b["w"] for b in boxes], dtype=np.float64) * scale
+    bh = np.array([b["h"] for b in boxes], dtype=np.float64) * scale
+    # window around the box with some context, never smaller than the patch itself
+    side = np.maximum(np.hypot(bw, bh) * 1.5, PATCH)
+
+    p = _sample_patches(prev, cx, cy, side)
+    c = _sample_patches(cur, cx + gdx, cy + gdy, side)
+    dy, dx, peak = phase_correlate(p, c)
+    step = side / PATCH  # downscaled pixels per patch pixel
+    ok = peak >= MIN_PEAK
+    mx = gdx + np.where(ok, dx * step, 0.0)
+    my = gdy + np.where(ok, dy * step, 0.0)
+    return (gdx / scale, gdy / scale), np.stack([mx, my], axis=1) / scale
+
+
+def shift_boxes(boxes, motion, img_size=None):
+    """Copies of `boxes` moved by motion[i]; centres are kept inside the image if its size is given."""
+    out = []
+    for b, (mx, my) in zip(boxes, motion):
+        nb = dict(b)
+        nb["cx"] = b["cx"] + float(mx)
+        nb["cy"] = b["cy"] + float(my)
+        if img_size:
+            nb["cx"] = min(max(nb["cx"], 0.0), img_size[0])
+            nb["cy"] = min(max(nb["cy"], 0.0), img_size[1])
+        out.append(nb)
+    return out
+
+
+def propagate_boxes(prev_path, cur_path, boxes, prev_frame=None, cur_frame=None):
+    """Boxes from prev_path moved onto cur_path. Frames can be passed in as (gray, scale) to skip decoding."""
+    prev, p_scale = prev_frame or load_frame(prev_path)
+    cur, c_scale = cur_frame or load_frame(cur_path)
+    if prev is None or cur is None:
+        return [dict(b) for b in boxes]
+    if not math.isclose(p_scale, c_scale, rel_tol=1e-3):
+        # frames of different size aren't a sequence we can correlate; copy as-is
+        return [dict(b) for b in boxes]
+    _, motion = estimate_motion(prev, cur, boxes, p_scale)
+    return shift_boxes(boxes, motion, read_image_size(cur_path))
+
+
+def propagate_sequence(paths, start, count, boxes=None, progress=None, should_stop=None):
+    """Propagate labels from paths[start] through the next `count` frames.
+
+    Frames that already have a sidecar are left untouched and their boxes are used
+    as the source for the following frame. A frame whose sidecar can't be parsed is
+    skipped, and the frame after it is propagated from the last good one. Empty
+    sidecars are never written: the run stops once there are no boxes to carry.
+    Returns (number of sidecars written, list of skipped sidecar paths).
+    """
+    if boxes is None:
+        boxes = load_boxes(sidecar_path(paths[start]))
+    src_path, src_frame = paths[start], load_frame(paths[start])
+    written = 0
+    skipped = []
+    end = min(start + count, len(paths) - 1)
+    for i in range(start + 1, end + 1):
+        if should_stop and should_stop():
+            break
+        cur_frame = load_frame(paths[i])
+        ann = sidecar_path(paths[i])
+        if os.path.exists(ann):
+            try:
+                boxes = load_boxes(ann)
+            except (OSError, ValueError):
+                skipped.append(ann)
+                continue
+        else:
+            if not boxes:
+                break
+            boxes = propagate_boxes(src_path, paths[i], boxes, src_frame, cur_frame)
+            save_boxes(ann, boxes)
+            written += 1
+        src_path, src_frame = paths[i], cur_frame
+        if progress:
+            progress(i - start, end - start)
+    return written, skipped
@@ -0,0 +1,250 @@
+""" Headless validator and statistics for a labelled image folder.
+
+Usage: python validate_dataset.py <folder> [--classes classes.txt] [--workers N] [--report issues.jsonl]
+
+Streams through the folder, hands batches of files to a process pool and merges
+per-batch counters, so memory stays flat no matter how many images there are.
+"""
+
+
+import os
+import sys
+import json
+import math
+import bisect
+import argparse
+from collections import Counter, deque
+from multiprocessing import Pool
+
+from dataset_utils import (
+    IMAGE_EXTS, SIDECAR_EXT, is_image_file, sidecar_path, load_classes, box_corners, read_image_size
+)
+
+
+class Histogram:
+    """Fixed-bin histogram; counts[i] holds values in [edges[i-1], edges[i])."""
+
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, v):
+        self.counts[bisect.bisect_right(self.edges, v)] += 1
+        self.n += 1
+        self.total += v
+        self.min = min(self.min, v)
+        self.max = max(self.max, v)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def rows(self):
+        """(bin label, count) pairs, skipping empty bins."""
+        bounds = [-math.inf] + self.edges + [math.inf]
+        for i, c in enumerate(self.counts):
+            if c:
+                yield f"[{bounds[i]:g}, {bounds[i + 1]:g})", c
+
+
+class DatasetStats:
+    def __init__(self):
+        self.images = 0
+        self.labelled = 0
+        self.boxes = 0
+        self.classes = Counter()
+        self.issues = Counter()
+        self.size = Histogram([8, 16, 32, 64, 128, 256, 512, 1024, 2048])  # sqrt(w*h) in px
+        self.aspect = Histogram([1.25, 1.5, 2, 3, 4, 6, 8, 16])  # long side / short side
+        self.angle = Histogram(range(-80, 81, 10))
+
+    def merge(self, other):
+        self.images += other.images
+        self.labelled += other.labelled
+        self.boxes += other.boxes
+        self.classes.update(other.classes)
+        self.issues.update(other.issues)
+        self.size.merge(other.size)
+        self.aspect.merge(other.aspect)
+        self.angle.merge(other.angle)
+
+
+def _issue(issues, stats, path, kind, detail="", box=None):
+    stats.issues[kind] += 1
+    rec = {"file": path, "issue": kind}
+    if box is not None:
+        rec["box"] = box
+    if detail:
+        rec["detail"] = detail
+    issues.append(rec)
+
+
+def _check_image(img_path, classes, tol, stats, issues):
+    stats.images += 1
+    size = read_image_size(img_path)
+    if size is None:
+        _issue(issues, stats, img_path, "unreadable_image")
+        return
+    img_w, img_h = size
+
+    ann = sidecar_path(img_path)
+    if not os.path.exists(ann):
+        _issue(issues, stats, img_path, "unlabelled_image")
+        return
+    try:
+        with open(ann, "r") as f:
+            boxes = json.load(f).get("boxes", [])
+    except (OSError, ValueError, AttributeError, RecursionError) as e:
+        _issue(issues, stats, ann, "bad_sidecar", str(e))
+        return
+    if not isinstance(boxes, list):
+        _issue(issues, stats, ann, "bad_sidecar", f"boxes is {type(boxes).__name__}, not a list")
+        return
+    stats.labelled += 1
+
+    for i, b in enumerate(boxes):
+        if not isinstance(b, dict):
+            _issue(issues, stats, ann, "bad_box", f"{type(b).__name__}, not an object", i)
+            continue
+        try:
+            cx, cy, w, h = (float(b[k]) for k in ("cx", "cy", "w", "h"))
+            angle = float(b.get("angle", 0.0))
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            _issue(issues, stats, ann, "bad_box", repr(e), i)
+            continue
+        label = b.get("label", "")
+        if not isinstance(label, str):
+            _issue(issues, stats, ann, "bad_box", f"label is {type(label).__name__}, not a string", i)
+            continue
+        stats.boxes += 1
+        stats.classes[label] += 1
+
+        if not all(map(math.isfinite, (cx, cy, w, h, angle))) or w <= 0 or h <= 0:
+            _issue(issues, stats, ann, "degenerate_box", f"w={w:g} h={h:g}", i)
+            continue
+        if not -90 < angle <= 90:
+            _issue(issues, stats, ann, "bad_angle", f"angle={angle:g}", i)
+        if classes is not None and label not in classes:
+            _issue(issues, stats, ann, "unknown_label", repr(label), i)
+
+        xs, ys = zip(*box_corners({"cx": cx, "cy": cy, "w": w, "h": h, "angle": angle}))
+        if min(xs) < -tol or min(ys) < -tol or max(xs) > img_w + tol or max(ys) > img_h + tol:
+            _issue(issues, stats, ann, "box_outside_image",
+                   f"extent=({min(xs):.1f}, {min(ys):.1f}, {max(xs):.1f}, {max(ys):.1f}) image={img_w}x{img_h}", i)
+
+        stats.size.add(math.sqrt(w * h))
+        stats.aspect.add(max(w, h) / min(w, h))
+        stats.angle.add(angle)
+
+
+def check_batch(paths, classes, tol):
+    """Worker entry point: validate a batch of files, return (issues, stats) for just this batch."""
+    stats = DatasetStats()
+    issues = []
+    for p in paths:
+        if p.endswith(SIDECAR_EXT):
+            base = p[:-len(SIDECAR_EXT)]
+            # Only "<image>.json" files are ours; anything else in the folder is ignored
+            if is_image_file(base) and not os.path.exists(base):
+                _issue(issues, stats, p, "orphan_sidecar")
+        else:
+            _check_image(p, classes, tol, stats, issues)
+    return issues, stats
+
+
+def iter_batches(folder, batch_size):
+    batch = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            ext = os.path.splitext(entry.name)[1].lower()
+            if ext in IMAGE_EXTS or ext == SIDECAR_EXT:
+                batch.append(entry.path)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def validate_folder(folder, classes=None, tol=1.0, workers=None, batch_size=256, on_issue=None):
+    """Validate every image/sidecar in `folder`. Issues are streamed to `on_issue`; returns merged DatasetStats."""
+    workers = workers or os.cpu_count() or 1
+    total = DatasetStats()
+    # Pool.imap would drain the whole listing into its task queue up front, so keep
+    # a bounded window of in-flight batches instead
+    pending = deque()
+    max_pending = workers * 4
+
+    def drain_one():
+        issues, stats = pending.popleft().get()
+        total.merge(stats)
+        if on_issue:
+            for rec in issues:
+                on_issue(rec)
+
+    with Pool(workers) as pool:
+        for batch in iter_batches(folder, batch_size):
+            pending.append(pool.apply_async(check_batch, (batch, classes, tol)))
+            while len(pending) >= max_pending:
+                drain_one()
+        while pending:
+            drain_one()
+    return total
+
+
+def print_summary(stats, out=sys.stdout):
+    p = lambda *a: print(*a, file=out)
+    p(f"images: {stats.images}  labelled: {stats.labelled}  boxes: {stats.boxes}")
+    p("\nclasses:")
+    for label, c in stats.classes.most_common():
+        p(f"  {label or '<empty>':<24} {c}")
+    for name, hist in (("box size sqrt(w*h) px", stats.size),
+                       ("aspect (long/short)", stats.aspect),
+                       ("angle deg", stats.angle)):
+        if not hist.n:
+            continue
+        p(f"\n{name}: min {hist.min:.2f}  mean {hist.total / hist.n:.2f}  max {hist.max:.2f}")
+        for rng, c in hist.rows():
+            p(f"  {rng:<20} {c}")
+    p("\nissues:" if stats.issues else "\nno issues found")
+    for kind, c in stats.issues.most_common():
+        p(f"  {kind:<24} {c}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Validate a labelled image folder and print dataset statistics.")
+    ap.add_argument("folder")
+    ap.add_argument("--classes", default="classes.txt", help="class list to check labels against (skipped if missing)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--batch-size", type=int, default=256)
+    ap.add_argument("--tolerance", type=float, default=1.0, help="pixels a box corner may stick out of the image")
+    ap.add_argument("--report", help="write issues as JSON lines here instead of printing them")
+    args = ap.parse_args()
+
+    classes = set(load_classes(args.classes)) if os.path.exists(args.classes) else None
+    if classes is None:
+        print(f"{args.classes} not found, skipping label check", file=sys.stderr)
+
+    report = open(args.report, "w") if args.report else sys.stdout
+    try:
+        stats = validate_folder(args.folder, classes, args.tolerance, args.workers, args.batch_size,
+                                on_issue=lambda rec: report.write(json.dumps(rec) + "\n"))
+    finally:
+        if args.report:
+            report.close()
+
+    print_summary(stats)
+    sys.exit(1 if stats.issues else 0)
+
+
+if __name__ == "__main__":
+    main()